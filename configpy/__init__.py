@@ -4,7 +4,15 @@ Configuration classes to provide access to config files.
 FileConfig parses a configuration file.
 StringConfig parses a configuration string.
 """
+import ast
+import os
 import re
+import signal
+import sys
+import time
+import weakref
+from array import array
+from itertools import chain
 
 try:
     # json supported since Python 2.6
@@ -22,6 +30,189 @@ SINGLE_LINE_COMMENT = re.compile('//.*\n')
 RE_HAS_EVAL = re.compile('.*\{\{.*\}\}.*')
 RE_EVAL = re.compile('(\{\{(.*)\}\})')
 
+# key of the directive that merges other config files into an object
+INCLUDE_KEY = '@include'
+
+# size in bytes an expression may be shown to reach when it has a
+# timeout that can't be enforced with SIGALRM
+STATIC_SIZE_LIMIT = 1024 * 1024
+
+# keys that can be stored in a ConfigView slot
+RE_SLOT_NAME = re.compile('^[A-Za-z_][A-Za-z0-9_]*$')
+
+class EvaluationLimitError(Exception):
+    """
+    Raised when evaluating a value exceeds one of the Config limits.
+    """
+
+class _Timeout(Exception):
+    """
+    Raised by the SIGALRM handler to interrupt an expression.
+    """
+
+def _alarm(signum, frame):
+    """
+    SIGALRM handler used to time out expressions.
+    """
+    raise _Timeout()
+
+def _restore_alarm(handler, timer, elapsed):
+    """
+    Reinstall the caller's SIGALRM handler and ITIMER_REAL timer, less
+    the time elapsed. A caller's alarm that was due while an expression
+    ran fires as soon as the expression completes.
+    """
+    if handler is None:
+        # the handler was not installed from Python
+        handler = signal.SIG_DFL
+    signal.signal(signal.SIGALRM, handler)
+    delay, interval = timer
+    if delay > 0:
+        signal.setitimer(signal.ITIMER_REAL, max(delay - elapsed, 1e-6),
+                         interval)
+
+def _exceeds_size(value, limit):
+    """
+    Returns whether the total size in bytes (sys.getsizeof) of value and
+    everything it contains exceeds limit. Stops as soon as it does.
+    """
+    size = 0
+    seen = set()
+    pending = [iter([value])]
+    while pending:
+        for item in pending[-1]:
+            if id(item) in seen:
+                continue
+            seen.add(id(item))
+            size += sys.getsizeof(item)
+            if size > limit:
+                return True
+            if isinstance(item, dict):
+                pending.append(chain.from_iterable(item.iteritems()))
+                break
+            if isinstance(item, (list, tuple, set, frozenset)):
+                pending.append(iter(item))
+                break
+        else:
+            pending.pop()
+    return False
+
+class _TooLarge(Exception):
+    """
+    Raised when an expression can be shown to exceed the size limit.
+    """
+
+# binary operations folded when both int operands are known
+_FOLD = {
+    ast.Add: lambda a, b: a + b,
+    ast.Sub: lambda a, b: a - b,
+    ast.Mult: lambda a, b: a * b,
+    ast.Pow: lambda a, b: a ** b,
+    ast.LShift: lambda a, b: a << b,
+    ast.RShift: lambda a, b: a >> b,
+}
+
+def _at_most(bound):
+    """
+    Returns the largest value of an int with the bound.
+    """
+    kind, bits, value = bound
+    if value is not None:
+        return abs(value)
+    if bits >= 64:
+        return float('inf')
+    return 2 ** bits
+
+def _binop_bound(op, left, right):
+    """
+    Returns the bound of a binary operation on operands with the bounds
+    left and right, or None if it isn't known.
+    """
+    if left is None or right is None:
+        return None
+    lkind, lsize, lvalue = left
+    rkind, rsize, rvalue = right
+    if lkind == 'int' and rkind == 'int':
+        if isinstance(op, ast.Mult):
+            bits = lsize + rsize
+        elif isinstance(op, ast.Pow):
+            bits = lsize * _at_most(right)
+        elif isinstance(op, ast.LShift):
+            bits = lsize + _at_most(right)
+        elif isinstance(op, ast.RShift):
+            bits = lsize
+        else:
+            bits = max(lsize, rsize) + 1
+        fold = _FOLD.get(type(op))
+        if fold is not None and lvalue is not None and rvalue is not None \
+                and bits <= 64 and rvalue >= 0:
+            value = fold(lvalue, rvalue)
+            return ('int', abs(value).bit_length(), value)
+        return ('int', bits, None)
+    if lkind in ('int', 'float') and rkind in ('int', 'float'):
+        # float operations overflow instead of growing
+        return ('float', 8, None)
+    if isinstance(op, ast.Mult):
+        if lkind == 'seq' and rkind == 'int':
+            return ('seq', lsize * _at_most(right), None)
+        if lkind == 'int' and rkind == 'seq':
+            return ('seq', rsize * _at_most(left), None)
+    if isinstance(op, ast.Add) and lkind == 'seq' and rkind == 'seq':
+        return ('seq', lsize + rsize, None)
+    return None
+
+def _bound(node, limit):
+    """
+    Returns a bound of the value of the expression node as (kind, size,
+    value): ('int', bits, value if known), ('float', bytes, None),
+    ('seq', bytes, None), or None if it isn't known. Raises _TooLarge
+    if any operation is shown to exceed limit bytes.
+    """
+    if isinstance(node, ast.Num):
+        if isinstance(node.n, (int, long)):
+            return ('int', abs(node.n).bit_length(), node.n)
+        return ('float', 8, None)
+    if isinstance(node, ast.Str):
+        return ('seq', len(node.s), None)
+    if isinstance(node, (ast.List, ast.Tuple, ast.Set)):
+        for elt in node.elts:
+            _bound(elt, limit)
+        # a pointer per item
+        return ('seq', 8 * len(node.elts), None)
+    if isinstance(node, ast.UnaryOp):
+        bound = _bound(node.operand, limit)
+        if bound is None or bound[0] != 'int' or bound[2] is None \
+                or isinstance(node.op, ast.UAdd):
+            return bound
+        if isinstance(node.op, ast.USub):
+            return ('int', bound[1], -bound[2])
+        return ('int', bound[1] + 1, None)
+    if isinstance(node, ast.BinOp):
+        bound = _binop_bound(node.op, _bound(node.left, limit),
+                             _bound(node.right, limit))
+        if bound is not None:
+            kind, size, value = bound
+            if kind == 'int':
+                size = size / 8
+            if size > limit:
+                raise _TooLarge()
+        return bound
+    for child in ast.iter_child_nodes(node):
+        _bound(child, limit)
+    return None
+
+def _too_large(expression, limit):
+    """
+    Returns whether an arithmetic or repetition operation in expression
+    would produce a value larger than limit bytes, judged from its
+    literal operands without evaluating it.
+    """
+    try:
+        _bound(ast.parse(expression, mode='eval'), limit)
+    except _TooLarge:
+        return True
+    return False
+
 class Node(object):
     """
     Represents any value in the configuration.
@@ -42,15 +233,21 @@ class Node(object):
         # the compound key name
         self.abskey = self._abskey()
         self.indent = ""
+        # the length of the longest chain of references from this value
+        self.depth = 0
+        # evaluation state, used to detect cyclic references
+        self._evaluating = False
+        self._evaluated = False
 
     def _resolve_var(self, value):
         """
-        Resolve the variables in the value.
+        Resolve the variables in the value. Referenced values are
+        evaluated first.
         """
         # if it's a Node, get it's value
         if isinstance(value, Node):
             value = value.value
-        
+
         # for each variable found in the value
         for match in RE_VAR_REF.finditer(value):
             var = match.group(1)
@@ -58,11 +255,17 @@ class Node(object):
                 raise KeyError("self reference")
             var_parts = var.split('.')
             ctx = self.root
+            abskey = []
             for vpart in var_parts:
+                # evaluate Nodes so their values can be indexed
+                if isinstance(ctx, Node):
+                    ctx = ctx._eval()
+
                 # if the context is a list convert the
                 # 'key' to a int
-                if isinstance(ctx, list):
+                if isinstance(ctx, (list, array)):
                     vpart = int(vpart)
+                abskey.append(unicode(vpart))
                     
                 # get the value
                 resolves_to = ctx[vpart]
@@ -70,13 +273,26 @@ class Node(object):
                 # change the context
                 ctx = resolves_to
 
-            # convert the value to a unicode string to check for more variables
+            # evaluate the referenced value, values evaluated earlier
+            # have been replaced in the tree so look up their depth
+            if isinstance(resolves_to, (Node, NodeDict, NodeList)):
+                target = resolves_to
+                resolves_to = target._eval()
+                depth = target.depth
+            else:
+                depth = self.root._depths.get(".".join(abskey), 0)
+            self.depth = max(self.depth, depth + 1)
+            max_depth = self.root._max_depth
+            if max_depth is not None and self.depth > max_depth:
+                raise EvaluationLimitError("%s: reference depth exceeds %d" \
+                                           % (self.abskey, max_depth))
+
+            # convert the value to a unicode string
             resolves_to = unicode(resolves_to)
-            if self._contains_variable(resolves_to):
-                resolves_to = self._resolve_var(resolves_to)
                 
             # replace the variable with the resolved value
             value = value.replace('${%s}' % var, resolves_to)
+            self._check_size(value)
         return value
 
     def _evalit(self, value):
@@ -91,20 +307,112 @@ class Node(object):
                 value = value.replace(eval_block, \
                                       unicode(self._evalit(to_eval)))
         if value[0] != " " and value[-1] != " ":
-            value = eval(unicode(value), \
-                         self.root._globals, self.root._locals)
+            value = self._timed_eval(value)
+            self._check_size(value)
+        return value
+
+    def _check_expression(self, expression, limit):
+        """
+        Raise an EvaluationLimitError if the expression can be shown to
+        produce a value larger than limit bytes before evaluating it.
+        """
+        if limit is not None and _too_large(expression, limit):
+            raise EvaluationLimitError("%s: result size exceeds %d bytes" \
+                                       % (self.abskey, limit))
+
+    def _check_size(self, value):
+        """
+        Raise an EvaluationLimitError if value is larger than the
+        max_result_size of the Config.
+        """
+        max_size = self.root._max_result_size
+        if max_size is not None and _exceeds_size(value, max_size):
+            raise EvaluationLimitError("%s: result size exceeds %d bytes" \
+                                       % (self.abskey, max_size))
+
+    def _timed_eval(self, expression):
+        """
+        Eval the expression, interrupting it if it runs longer than the
+        per-expression or total evaluation time allows. Interrupting
+        requires SIGALRM (main thread, Unix). Without it, expressions
+        with operations that can be shown from their literal operands
+        to produce more than STATIC_SIZE_LIMIT bytes are rejected, and
+        other expressions (comprehensions, calls) are only checked once
+        they complete.
+        """
+        root = self.root
+        timeout = root._expression_timeout
+        if root._deadline is not None:
+            remaining = root._deadline - time.time()
+            if remaining <= 0:
+                raise EvaluationLimitError("%s: evaluation timeout exceeded" \
+                                           % self.abskey)
+            if timeout is None or remaining < timeout:
+                timeout = remaining
+        if timeout is None:
+            self._check_expression(expression, root._max_result_size)
+            return eval(expression, root._globals, root._locals)
+
+        armed = False
+        if hasattr(signal, 'setitimer'):
+            try:
+                previous = signal.signal(signal.SIGALRM, _alarm)
+                armed = True
+            except ValueError:
+                # signals can only be used in the main thread
+                pass
+        limit = root._max_result_size
+        if limit is None and not armed:
+            limit = STATIC_SIZE_LIMIT
+        start = time.time()
+        try:
+            try:
+                try:
+                    if armed:
+                        caller_timer = signal.setitimer(signal.ITIMER_REAL,
+                                                        timeout)
+                    self._check_expression(expression, limit)
+                    value = eval(expression, root._globals, root._locals)
+                finally:
+                    if armed:
+                        signal.setitimer(signal.ITIMER_REAL, 0)
+            finally:
+                if armed:
+                    _restore_alarm(previous, caller_timer,
+                                   time.time() - start)
+        except _Timeout:
+            raise EvaluationLimitError("%s: evaluation timeout exceeded" \
+                                       % self.abskey)
+        if time.time() - start >= timeout:
+            raise EvaluationLimitError("%s: evaluation timeout exceeded" \
+                                       % self.abskey)
         return value
-            
+
     def _eval(self):
         """
         Evaluate the contents of the Node and return the value.
         """
-        # if there is a variable in there resolve it
-        if self._contains_variable(self.value):
-            self.value = self._resolve_var(self.value)
-        # if there is anything to be evaluated do so
-        if self._contains_eval():
-            self.value = self._evalit(self.value)
+        if self._evaluated:
+            return self.value
+        if self._evaluating:
+            raise KeyError("cyclic reference: %s" % self.abskey)
+        deadline = self.root._deadline
+        if deadline is not None and time.time() > deadline:
+            raise EvaluationLimitError("%s: evaluation timeout exceeded" \
+                                       % self.abskey)
+        self._evaluating = True
+        try:
+            # if there is a variable in there resolve it
+            if self._contains_variable(self.value):
+                self.value = self._resolve_var(self.value)
+            # if there is anything to be evaluated do so
+            if self._contains_eval():
+                self.value = self._evalit(self.value)
+        finally:
+            self._evaluating = False
+        self._evaluated = True
+        if self.depth:
+            self.root._depths[self.abskey] = self.depth
         return self.value
 
 
@@ -137,6 +445,7 @@ class Node(object):
         while parent.key is not None:
             parts.append(unicode(parent.key))
             parent = parent.parent
+        parts.reverse()
         return ".".join(parts)
 
     def __unicode__(self):
@@ -169,6 +478,9 @@ class NodeDict(dict):
         self.key = key
         # the parent of this Node (dict or list)
         self.parent = parent
+        # the length of the longest chain of references from a child
+        self.depth = 0
+        self._evaluated = False
 
         dict.__init__(self, *args, **kwargs)
         self._init_nodes()
@@ -182,7 +494,7 @@ class NodeDict(dict):
             if isinstance(value, dict):
                 self[key] = NodeDict(self.root, self, key, value)
             elif isinstance(value, list):
-                self[key] = NodeList(self.root, self, key, value)
+                self[key] = _list_node(self.root, self, key, value)
             else:
                 self[key] = Node(self.root, self, key, value)
 
@@ -190,9 +502,14 @@ class NodeDict(dict):
         """
         Set the comupted value for each child Node.
         """
+        if self._evaluated:
+            return self
         for key in self.keys():
             value = self[key]
-            self[key] = value._eval()
+            if isinstance(value, (Node, NodeDict, NodeList)):
+                self[key] = value._eval()
+                self.depth = max(self.depth, value.depth)
+        self._evaluated = True
         return self
 
     def __getattr__(self, attr):
@@ -215,6 +532,9 @@ class NodeList(list):
         self.key = key
         # the parent of this Node (dict or list)
         self.parent = parent
+        # the length of the longest chain of references from a child
+        self.depth = 0
+        self._evaluated = False
 
         list.__init__(self, *args, **kwargs)
         self._init_nodes()
@@ -228,7 +548,7 @@ class NodeList(list):
             if isinstance(value, dict):
                 self[index] = NodeDict(self.root, self, index, value)
             elif isinstance(value, list):
-                self[index] = NodeList(self.root, self, index, value)
+                self[index] = _list_node(self.root, self, index, value)
             else:
                 self[index] = Node(self.root, self, index, value)
             index += 1
@@ -237,22 +557,447 @@ class NodeList(list):
         """
         Set the comupted value for each child Node.
         """
+        if self._evaluated:
+            return self
         index = 0
         for value in self:
-            self[index] = value._eval()
+            if isinstance(value, (Node, NodeDict, NodeList)):
+                self[index] = value._eval()
+                self.depth = max(self.depth, value.depth)
             index += 1
+        self._evaluated = True
+        return self
+
+class NodeArray(array):
+    """
+    Represents a homogeneous numeric array (JSON terminology) in the
+    configuration. The values are stored unboxed, no Nodes are created.
+    """
+
+    def __new__(cls, root, parent, key, typecode, values):
+        return array.__new__(cls, typecode, values)
+
+    def __init__(self, root, parent, key, typecode, values):
+        # root of tree (the config object)
+        self.root = root
+        # the key for this item (dict key or list index)
+        self.key = key
+        # the parent of this Node (dict or list)
+        self.parent = parent
+
+    def _eval(self):
+        """
+        Numbers need no evaluation.
+        """
         return self
 
+    def __eq__(self, other):
+        """
+        Compare equal to any array or list with the same values.
+        """
+        if isinstance(other, (list, tuple, array)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def __repr__(self):
+        """
+        Returns the list representation so references can be eval'd.
+        """
+        return repr(self.tolist())
+
+    __str__ = __repr__
+
+    def __reduce__(self):
+        """
+        Pickle as a plain array, the tree links are not kept.
+        """
+        return (array, (self.typecode, self.tolist()))
+
+def _array_typecode(values):
+    """
+    Returns the array typecode for a homogeneous numeric list, or None.
+    """
+    if not values:
+        return None
+    first = type(values[0])
+    if first is float:
+        typecode = 'd'
+    elif first in (int, long):
+        typecode = 'l'
+    else:
+        # bool is deliberately excluded
+        return None
+    for value in values:
+        if type(value) is not first:
+            return None
+    return typecode
+
+def _list_node(root, parent, key, value):
+    """
+    Create a NodeArray for large homogeneous numeric lists, and a
+    NodeList for everything else.
+    """
+    threshold = root._array_threshold
+    if threshold is not None and len(value) >= threshold:
+        typecode = _array_typecode(value)
+        if typecode is not None:
+            try:
+                return NodeArray(root, parent, key, typecode, value)
+            except OverflowError:
+                # int too large for a C long
+                pass
+    return NodeList(root, parent, key, value)
+
+class ConfigView(object):
+    """
+    Read-only view of an evaluated object (JSON terminology). A subclass
+    with a slot per key is generated for each distinct set of keys, so
+    dotted access costs the same as normal attribute access. Keys that
+    aren't identifiers, or are dunder names, are only available as items.
+    """
+    __slots__ = ('__extra__',)
+
+    # sorted keys of this shape, and those stored in slots
+    __keys__ = ()
+    __slotkeys__ = frozenset()
+
+    def __getitem__(self, key):
+        if key in self.__slotkeys__:
+            return getattr(self, key)
+        return self.__extra__[key]
+
+    def __contains__(self, key):
+        return key in self.__keys__
+
+    def __iter__(self):
+        return iter(self.__keys__)
+
+    def __len__(self):
+        return len(self.__keys__)
+
+    def __setattr__(self, attr, value):
+        raise AttributeError("ConfigView is read-only")
+
+    def __delattr__(self, attr):
+        raise AttributeError("ConfigView is read-only")
+
+    def __repr__(self):
+        items = ["%s: %r" % (key, self[key]) for key in self.__keys__]
+        return "ConfigView({%s})" % ", ".join(items)
+
+# generated ConfigView classes, sorted keys -> class. The views keep
+# their class alive, a class is dropped once its views are.
+_VIEW_CLASSES = weakref.WeakValueDictionary()
+
+def _is_slot_key(key):
+    """
+    Returns whether the key can be stored in a ConfigView slot. Dunder
+    names are excluded, which covers the ConfigView internals.
+    """
+    return RE_SLOT_NAME.match(key) is not None and not key.startswith('__')
+
+def _view_class(keys):
+    """
+    Returns the ConfigView subclass for the (sorted) keys.
+    """
+    cls = _VIEW_CLASSES.get(keys)
+    if cls is None:
+        slots = tuple([str(key) for key in keys if _is_slot_key(key)])
+        cls = type('ConfigView', (ConfigView,), {
+            '__slots__': slots,
+            '__keys__': keys,
+            '__slotkeys__': frozenset(slots),
+        })
+        _VIEW_CLASSES[keys] = cls
+    return cls
+
+def _make_view(value):
+    """
+    Returns a read-only copy of the evaluated value. Objects become
+    ConfigViews, arrays (including NodeArrays) become tuples.
+    """
+    if isinstance(value, dict):
+        keys = tuple(sorted(value.keys()))
+        cls = _view_class(keys)
+        view = object.__new__(cls)
+        extra = {}
+        for key in keys:
+            item = _make_view(value[key])
+            if key in cls.__slotkeys__:
+                object.__setattr__(view, key, item)
+            else:
+                extra[key] = item
+        object.__setattr__(view, '__extra__', extra)
+        return view
+    if isinstance(value, list):
+        return tuple([_make_view(item) for item in value])
+    if isinstance(value, array):
+        return tuple(value)
+    return value
+
+# parsed include files, abspath -> (mtime, parsed JSON)
+_INCLUDE_CACHE = {}
+
+def _parse(config_str):
+    """
+    Strip comments from the config string and parse the JSON.
+    """
+    config_str = MULTI_LINE_COMMENT.sub('', config_str, re.DOTALL|re.M)
+    config_str = SINGLE_LINE_COMMENT.sub('\n', config_str, re.DOTALL|re.M)
+    return json.loads(config_str)
+
+def _load_include(filepath):
+    """
+    Returns the parsed contents of an include file. Each file is parsed
+    once per process, and again only if its mtime changes.
+    """
+    mtime = os.path.getmtime(filepath)
+    cached = _INCLUDE_CACHE.get(filepath)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    config_file = open(filepath)
+    config_str = config_file.read()
+    config_file.close()
+    parsed = _parse(config_str)
+    _INCLUDE_CACHE[filepath] = (mtime, parsed)
+    return parsed
+
+def clear_include_cache():
+    """
+    Discard all cached include files.
+    """
+    _INCLUDE_CACHE.clear()
+
+def _rebase(value, prefix, keys):
+    """
+    Returns a copy of value with every variable whose first part is in
+    keys prefixed with prefix.
+    """
+    if isinstance(value, basestring):
+        if '${' not in value:
+            return value
+        def rebase_var(match):
+            var = match.group(1)
+            if var.split('.')[0] in keys:
+                var = '%s.%s' % (prefix, var)
+            return '${%s}' % var
+        return RE_VAR_REF.sub(rebase_var, value)
+    if isinstance(value, list):
+        return [_rebase(item, prefix, keys) for item in value]
+    if isinstance(value, dict):
+        result = {}
+        for key, item in value.items():
+            result[key] = _rebase(item, prefix, keys)
+        return result
+    return value
+
+def _expand_includes(value, basedir, path=(), stack=()):
+    """
+    Returns value with every include directive replaced by the keys of
+    the included files. Keys in the including object take precedence.
+    Relative paths are resolved against basedir. Objects and arrays are
+    only copied when an include is found inside them, so neither value
+    nor the cached include files are modified.
+
+    path is the compound key of value. Variables in an included file
+    that refer to its own keys are rebased onto the include point.
+    """
+    if isinstance(value, list):
+        result = None
+        index = 0
+        for item in value:
+            if isinstance(item, (dict, list)):
+                expanded = _expand_includes(item, basedir, path + (index,),
+                                            stack)
+                if expanded is not item:
+                    if result is None:
+                        result = list(value)
+                    result[index] = expanded
+            index += 1
+        if result is None:
+            return value
+        return result
+    if not isinstance(value, dict):
+        return value
+
+    if INCLUDE_KEY in value:
+        result = {}
+        includes = value[INCLUDE_KEY]
+        if isinstance(includes, basestring):
+            includes = [includes]
+        for include in includes:
+            filepath = os.path.abspath(os.path.join(basedir, include))
+            if filepath in stack:
+                raise ValueError("cyclic include: %s" % filepath)
+            included = _load_include(filepath)
+            if not isinstance(included, dict):
+                raise ValueError("included file is not an object: %s" \
+                                 % filepath)
+            included = _expand_includes(included, os.path.dirname(filepath),
+                                        (), stack + (filepath,))
+            if path:
+                prefix = '.'.join([unicode(part) for part in path])
+                included = _rebase(included, prefix, set(included.keys()))
+            result.update(included)
+    else:
+        result = None
+
+    for key, item in value.items():
+        if key == INCLUDE_KEY:
+            continue
+        expanded = item
+        if isinstance(item, (dict, list)):
+            expanded = _expand_includes(item, basedir, path + (key,), stack)
+        if result is not None:
+            result[key] = expanded
+        elif expanded is not item:
+            result = dict(value)
+            result[key] = expanded
+    if result is None:
+        return value
+    return result
+
+# number of NodeArray items encoded per chunk
+ARRAY_CHUNK = 1024
+
+class _ConfigEncoder(json.JSONEncoder):
+    """
+    JSON encoder that yields the configuration in chunks, encoding
+    NodeArrays a slice at a time rather than converting them to lists.
+    """
+
+    def default(self, obj):
+        """
+        Convert the configpy types the json module can't encode.
+        """
+        if isinstance(obj, Node):
+            return obj._eval()
+        return json.JSONEncoder.default(self, obj)
+
+    def iterencode(self, o, _one_shot=False):
+        return self._iterencode(o, 0)
+
+    def _scalar(self, value):
+        """
+        Returns the JSON for a value that isn't an object or array.
+        """
+        return ''.join(json.JSONEncoder.iterencode(self, value, True))
+
+    def _iterencode(self, o, level):
+        if isinstance(o, Node):
+            o = o._eval()
+        if isinstance(o, dict):
+            begin, end = '{', '}'
+            items = o.items()
+            if self.sort_keys:
+                items.sort()
+        elif isinstance(o, (list, tuple, array)):
+            begin, end = '[', ']'
+        else:
+            yield self._scalar(o)
+            return
+        if not o:
+            yield begin + end
+            return
+
+        if self.indent is not None:
+            level += 1
+            newline_indent = '\n' + ' ' * (self.indent * level)
+            separator = self.item_separator + newline_indent
+            yield begin + newline_indent
+        else:
+            newline_indent = None
+            separator = self.item_separator
+            yield begin
+
+        if isinstance(o, array):
+            if o.typecode in 'fd':
+                encode = self._scalar
+            else:
+                encode = str
+            for start in xrange(0, len(o), ARRAY_CHUNK):
+                chunk = separator.join(map(encode,
+                                           o[start:start + ARRAY_CHUNK]))
+                if start:
+                    chunk = separator + chunk
+                yield chunk
+        elif isinstance(o, dict):
+            first = True
+            for key, value in items:
+                if not isinstance(key, basestring):
+                    key = self._scalar(key)
+                if first:
+                    first = False
+                else:
+                    yield separator
+                yield self._scalar(key) + self.key_separator
+                for chunk in self._iterencode(value, level):
+                    yield chunk
+        else:
+            first = True
+            for value in o:
+                if first:
+                    first = False
+                else:
+                    yield separator
+                for chunk in self._iterencode(value, level):
+                    yield chunk
+
+        if newline_indent is not None:
+            yield '\n' + ' ' * (self.indent * (level - 1))
+        yield end
+
 class Config(NodeDict):
     """
     Represents the JSON configuration object.
     """
 
-    def __init__(self, config_str, restricted=True):
+    def __init__(self, config_str, restricted=True,
+                 array_threshold=None, basedir=None,
+                 timeout=None, expression_timeout=None,
+                 max_result_size=None, max_depth=None):
         """
         Initialize the Config.
+
+        If array_threshold is set, homogeneous numeric lists with at
+        least that many items are stored as a NodeArray (an array.array,
+        not a list) instead of one Node per item.
+
+        Relative include paths are resolved against basedir (defaults
+        to the current working directory).
+
+        To protect against untrusted configs evaluation can be limited:
+        timeout and expression_timeout are the maximum seconds spent
+        evaluating the whole config and any one expression,
+        max_result_size is the maximum size in bytes of an expression
+        result (including everything it contains) or of a string built
+        by variable substitution, and max_depth is the maximum length of
+        a chain of variable references (a value referring to a value
+        referring to ...). Exceeding a limit raises an
+        EvaluationLimitError naming the key. Timeouts use SIGALRM and
+        ITIMER_REAL when loading in the main thread; the caller's handler
+        and timer are restored after each expression, but an alarm due
+        while an expression runs is delayed until it completes. Loading
+        in other threads can't interrupt expressions: operations that
+        can be shown to produce more than max_result_size (or
+        STATIC_SIZE_LIMIT) bytes are rejected before evaluation, but
+        other long running expressions are only detected when they end.
         """
-        
+        self._array_threshold = array_threshold
+        self._timeout = timeout
+        self._expression_timeout = expression_timeout
+        self._max_result_size = max_result_size
+        self._max_depth = max_depth
+        self._deadline = None
+        # reference depths of evaluated Nodes, by compound key
+        self._depths = {}
+
         # how to handle evaluations
         if restricted:
             self._globals = {'__builtins__': None}
@@ -260,13 +1005,15 @@ class Config(NodeDict):
             self._globals = globals()
         self._locals = {}
     
-        # strip comments (if any exist)
-        config_str = MULTI_LINE_COMMENT.sub('', config_str, re.DOTALL|re.M)
-        config_str = SINGLE_LINE_COMMENT.sub('\n', config_str, re.DOTALL|re.M)
-        
-        # parse JSON
-        config_dict = json.loads(config_str)
-        
+        # strip comments (if any exist) and parse JSON
+        config_dict = _parse(config_str)
+
+        # merge in any included files
+        if INCLUDE_KEY in config_str:
+            if basedir is None:
+                basedir = os.getcwd()
+            config_dict = _expand_includes(config_dict, basedir)
+
         # save the entries in this dict
         self.update(config_dict)
         
@@ -276,7 +1023,48 @@ class Config(NodeDict):
         
         # all the initialisation (tree building) is complete,
         # go compute the values.
-        self._eval()
+        if timeout is not None:
+            self._deadline = time.time() + timeout
+        try:
+            self._eval()
+        finally:
+            self._deadline = None
+            self._depths = {}
+
+    def view(self):
+        """
+        Returns a read-only ConfigView of the evaluated configuration.
+        Every key is available as an attribute (or as an item when it
+        isn't an identifier), including keys like 'keys' or 'items'.
+        """
+        return _make_view(self)
+
+    def _encoder(self, sort_keys, compact, indent):
+        """
+        Returns the encoder for dump(s).
+        """
+        if compact:
+            separators = (',', ':')
+        else:
+            separators = (', ', ': ')
+        return _ConfigEncoder(sort_keys=sort_keys, indent=indent,
+                              separators=separators)
+
+    def dump(self, fp, sort_keys=False, compact=False, indent=None):
+        """
+        Write the evaluated configuration as JSON to the file object fp.
+        The output is written in chunks, the complete string is never
+        built in memory.
+        """
+        encoder = self._encoder(sort_keys, compact, indent)
+        for chunk in encoder.iterencode(self):
+            fp.write(chunk)
+
+    def dumps(self, sort_keys=False, compact=False, indent=None):
+        """
+        Returns the evaluated configuration as a JSON string.
+        """
+        return self._encoder(sort_keys, compact, indent).encode(self)
 
 class FileConfig(Config):
     """
@@ -286,4 +1074,6 @@ class FileConfig(Config):
         config_file = open(filepath)
         config_str = config_file.read()
         config_file.close()
+        kwargs.setdefault('basedir',
+                          os.path.dirname(os.path.abspath(filepath)))
         Config.__init__(self, config_str, **kwargs)
@@ -1,12 +1,23 @@
 """
 Tests for configpy
 """
-import os, unittest
+import gc, itertools, os, operator, pickle, shutil, signal, tempfile, threading
+import time, unittest, weakref
+from array import array
+from StringIO import StringIO
 
-from configpy import Config, FileConfig
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from configpy import Config, FileConfig, NodeArray, EvaluationLimitError
+from configpy import clear_include_cache
 
 THIS_DIR = os.path.dirname(__file__)
 CFG_PATH = os.path.abspath(os.path.join(THIS_DIR,'test.cfg'))
+INCLUDE_PATH = os.path.abspath(os.path.join(THIS_DIR,'include_main.cfg'))
+INCLUDE_COMMON_PATH = os.path.abspath(os.path.join(THIS_DIR,'include_common.cfg'))
 
 class ConfigTest(unittest.TestCase):
     """
@@ -222,6 +233,21 @@ class ConfigTest(unittest.TestCase):
         except KeyError:
             """Expected error"""
 
+    def test_nested_self_reference(self):
+        """
+        Test a self reference inside a nested object.
+        """
+        config_json = """
+        {
+            "a": { "b": "${a.b}" }
+        }
+        """
+        try:
+            config = Config(config_json)
+            self.fail("KeyError not raised")
+        except KeyError:
+            """Expected error"""
+
     def test_cyclic_reference(self):
         config_json = """
         {
@@ -407,5 +433,495 @@ class ConfigTest(unittest.TestCase):
         self.assertNotEquals(2, config.keys)
         self.assertEquals(2, config['keys'])
 
+    def test_numeric_array(self):
+        """
+        Test homogeneous numeric lists stored as a NodeArray.
+        """
+        config_json = """
+        {
+            "ints": [1, 2, 3, 4],
+            "floats": [0.5, 1.5],
+            "mixed": [1, 2.5],
+            "strs": ["a", "b"],
+            "bools": [true, false],
+            "refs": [1, "${ints.0}"],
+            "f": "${ints.2}",
+            "g": "{{ ${floats.1} * 2 }}",
+            "h": "{{ sum(${ints}) }}"
+        }
+        """
+        config = Config(config_json, restricted=False, array_threshold=2)
+        self.assertTrue(isinstance(config['ints'], NodeArray))
+        self.assertTrue(isinstance(config['floats'], NodeArray))
+        self.assertFalse(isinstance(config['mixed'], NodeArray))
+        self.assertFalse(isinstance(config['strs'], NodeArray))
+        self.assertFalse(isinstance(config['bools'], NodeArray))
+        self.assertFalse(isinstance(config['refs'], NodeArray))
+        self.assertEquals([1, 2, 3, 4], config['ints'])
+        self.assertEquals(3, config.ints[2])
+        self.assertEquals([1, u'1'], config['refs'])
+        self.assertEquals(u'3', config['f'])
+        self.assertEquals(3.0, config['g'])
+        self.assertEquals(10, config['h'])
+
+    def test_numeric_array_threshold(self):
+        """
+        Test lists shorter than array_threshold are kept as lists.
+        """
+        config_json = """
+        {
+            "a": [1, 2, 3]
+        }
+        """
+        config = Config(config_json, array_threshold=4)
+        self.assertFalse(isinstance(config['a'], NodeArray))
+
+    def test_numeric_array_default(self):
+        """
+        Test large numeric lists are plain lists by default.
+        """
+        config_json = '{ "t": %s }' % json.dumps(range(2000))
+        config = Config(config_json)
+        self.assertTrue(isinstance(config['t'], list))
+        self.assertFalse(isinstance(config['t'], NodeArray))
+        self.assertEquals(json.dumps({"t": range(2000)}), json.dumps(config))
+        self.assertEquals(range(2001), config['t'] + [2000])
+        self.assertEquals(range(2000),
+                          pickle.loads(pickle.dumps(config['t'], 2)))
+
+    def test_numeric_array_pickle(self):
+        """
+        Test a NodeArray pickles as a plain array.
+        """
+        config = Config('{ "t": [1, 2, 3] }', array_threshold=1)
+        for protocol in (0, 2):
+            t = pickle.loads(pickle.dumps(config['t'], protocol))
+            self.assertEquals(array('l', [1, 2, 3]), t)
+
+    def test_include(self):
+        """
+        Test merging included files.
+        """
+        config = FileConfig(INCLUDE_PATH)
+        self.assertFalse("@include" in config)
+        self.assertEquals("localhost", config['db_host'])
+        self.assertEquals(6543, config['db_port'])
+        self.assertEquals("localhost:6543/testdb", config['db_url'])
+        self.assertEquals("localhost", config.services.db_host)
+        self.assertEquals("localhost", config.services.name)
+        self.assertEquals(5432, config.services.db_port)
+        self.assertEquals("localhost:5432/testdb", config.services.db_url)
+
+    def test_include_nested_references(self):
+        """
+        Test references within a file included below the top level.
+        """
+        config_json = """
+        {
+            "sub": {
+                "@include": "include_nested.cfg",
+                "base": "local"
+            },
+            "dbs": [ { "@include": "include_nested.cfg" } ],
+            "outside": "O"
+        }
+        """
+        config = Config(config_json, basedir=THIS_DIR)
+        self.assertEquals("local", config.sub.nested.x)
+        self.assertEquals(["local", "O"], config.sub.list)
+        self.assertEquals("B", config.dbs[0].nested.x)
+        self.assertEquals(["B", "O"], config.dbs[0].list)
+
+    def test_include_string(self):
+        """
+        Test an include in a string config resolved against basedir.
+        """
+        config_json = """
+        {
+            "@include": "%s",
+            "db_name": "prod"
+        }
+        """ % os.path.basename(INCLUDE_COMMON_PATH)
+        config = Config(config_json, basedir=THIS_DIR)
+        self.assertEquals("localhost:5432/prod", config['db_url'])
+
+    def test_include_cache(self):
+        """
+        Test included files are only parsed again when their mtime changes.
+        """
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'common.cfg')
+            def write(value, mtime):
+                common = open(path, 'w')
+                common.write('{ "a": %d }' % value)
+                common.close()
+                os.utime(path, (mtime, mtime))
+            def load():
+                return Config('{ "@include": "common.cfg" }', basedir=tmpdir)
+
+            clear_include_cache()
+            write(1, 1000000000)
+            self.assertEquals(1, load()['a'])
+            # same mtime, the cached parse is used
+            write(2, 1000000000)
+            self.assertEquals(1, load()['a'])
+            # new mtime, the file is parsed again
+            write(3, 1000000010)
+            self.assertEquals(3, load()['a'])
+            write(4, 1000000010)
+            clear_include_cache()
+            self.assertEquals(4, load()['a'])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_include_in_list(self):
+        """
+        Test an include inside an array.
+        """
+        config_json = """
+        {
+            "dbs": [
+                { "name": "none" },
+                { "@include": "include_plain.cfg", "port": 6543 }
+            ]
+        }
+        """
+        config = Config(config_json, basedir=THIS_DIR)
+        self.assertEquals({"name": "none"}, config.dbs[0])
+        self.assertEquals({"host": "localhost", "port": 6543}, config.dbs[1])
+
+    def test_include_cycle(self):
+        """
+        Test a file including itself.
+        """
+        try:
+            FileConfig(os.path.join(THIS_DIR, 'include_cycle.cfg'))
+            self.fail("ValueError not raised")
+        except ValueError:
+            """Expected error"""
+
+    def test_dumps(self):
+        """
+        Test sorted and compact JSON output.
+        """
+        config_json = """
+        {
+            "b": "${a} pie",
+            "a": "simple",
+            "c": [1, 2, "{{ 1 + 2 }}"],
+            "d": { "e": "${c.2}" },
+            "f": [1, 2, 3]
+        }
+        """
+        config = Config(config_json, array_threshold=3)
+        self.assertEquals('{"a":"simple","b":"simple pie","c":[1,2,3],'
+                          '"d":{"e":"3"},"f":[1,2,3]}',
+                          config.dumps(sort_keys=True, compact=True))
+        self.assertEquals('{"a": "simple", "b": "simple pie", "c": [1, 2, 3], '
+                          '"d": {"e": "3"}, "f": [1, 2, 3]}',
+                          config.dumps(sort_keys=True))
+
+    def test_dump(self):
+        """
+        Test writing JSON to a file object.
+        """
+        config = FileConfig(CFG_PATH)
+        out = StringIO()
+        config.dump(out, sort_keys=True, indent=2)
+        self.assertEquals(config.dumps(sort_keys=True, indent=2),
+                          out.getvalue())
+        self.assertEquals(config, json.loads(out.getvalue()))
+
+    def test_dump_array_chunks(self):
+        """
+        Test large arrays are written in several chunks.
+        """
+        config_json = json.dumps({"ints": range(5000),
+                                  "floats": [i / 4.0 for i in range(5000)],
+                                  "nested": [[1, 2], {"a": [0.5]}]})
+        config = Config(config_json, array_threshold=1000)
+        for options in [{}, {"compact": True}, {"indent": 2}]:
+            chunks = []
+            class Writer(object):
+                def write(self, chunk):
+                    chunks.append(chunk)
+            config.dump(Writer(), sort_keys=True, **options)
+            output = "".join(chunks)
+            self.assertEquals(json.loads(config_json), json.loads(output))
+            self.assertEquals(json.dumps(json.loads(config_json),
+                                         sort_keys=True,
+                                         indent=options.get("indent"),
+                                         separators=options.get("compact")
+                                         and (',', ':') or (', ', ': ')),
+                              output)
+            self.assertTrue(len(chunks) > 10)
+            self.assertTrue(max([len(c) for c in chunks]) < len(output) / 4)
+
+    def test_expression_timeout(self):
+        """
+        Test an expression running longer than expression_timeout.
+        """
+        config_json = """
+        {
+            "a": 1,
+            "huge": "{{ 10**10**8 }}"
+        }
+        """
+        try:
+            Config(config_json, expression_timeout=0.1)
+            self.fail("EvaluationLimitError not raised")
+        except EvaluationLimitError, e:
+            self.assertTrue("huge" in str(e))
+
+    def test_timeout(self):
+        """
+        Test evaluation running longer than the total timeout.
+        """
+        config_json = """
+        {
+            "a": { "huge": "{{ 10**10**8 }}" }
+        }
+        """
+        try:
+            Config(config_json, timeout=0.1)
+            self.fail("EvaluationLimitError not raised")
+        except EvaluationLimitError, e:
+            self.assertTrue("a.huge" in str(e))
+
+    def test_max_result_size(self):
+        """
+        Test an expression result larger than max_result_size.
+        """
+        config_json = """
+        {
+            "small": "{{ [0] * 10 }}",
+            "big": "{{ [0] * 10000 }}"
+        }
+        """
+        try:
+            Config(config_json, max_result_size=1000)
+            self.fail("EvaluationLimitError not raised")
+        except EvaluationLimitError, e:
+            self.assertTrue("big" in str(e))
+        config = Config(config_json, max_result_size=100000)
+        self.assertEquals(10000, len(config['big']))
+
+    def test_max_result_size_nested(self):
+        """
+        Test max_result_size counts the contents of containers.
+        """
+        for expression in ['[[0] * 1000 for i in [0] * 10]',
+                           '["a" * 100000]',
+                           '{"a": ("b" * 100000,)}']:
+            config_json = json.dumps({"big": "{{ %s }}" % expression})
+            try:
+                Config(config_json, max_result_size=10000)
+                self.fail("EvaluationLimitError not raised")
+            except EvaluationLimitError, e:
+                self.assertTrue("big" in str(e))
+
+    def test_max_result_size_static(self):
+        """
+        Test operations shown to exceed max_result_size are not run.
+        """
+        for expression in ['[0] * 10**9', '"a" * (2 << 40)', '10**10**8',
+                           '[1, 10**10**8]']:
+            config_json = json.dumps({"big": "{{ %s }}" % expression})
+            start = time.time()
+            try:
+                Config(config_json, max_result_size=10**6)
+                self.fail("EvaluationLimitError not raised")
+            except EvaluationLimitError, e:
+                self.assertTrue("big" in str(e))
+            self.assertTrue(time.time() - start < 1)
+        config = Config('{ "a": "{{ 2**10 * [0] }}" }', max_result_size=10**6)
+        self.assertEquals(1024, len(config['a']))
+
+    def test_expression_timeout_thread(self):
+        """
+        Test expression_timeout when loading off the main thread.
+        """
+        errors = []
+        def load(config_json):
+            try:
+                errors.append(Config(config_json, expression_timeout=0.05))
+            except EvaluationLimitError, e:
+                errors.append(e)
+        start = time.time()
+        thread = threading.Thread(target=load,
+                                  args=('{ "k": "{{ 10**10**7 }}" }',))
+        thread.start()
+        thread.join()
+        self.assertTrue(isinstance(errors[0], EvaluationLimitError))
+        self.assertTrue("k" in str(errors[0]))
+        self.assertTrue(time.time() - start < 1)
+        thread = threading.Thread(target=load,
+                                  args=('{ "k": "{{ 2**10 }}" }',))
+        thread.start()
+        thread.join()
+        self.assertEquals(1024, errors[1]['k'])
+
+    def test_max_result_size_substitution(self):
+        """
+        Test max_result_size limits strings built by variable references.
+        """
+        config = {"k0": "ab"}
+        for i in range(1, 23):
+            config["k%d" % i] = "${k%d}${k%d}" % (i - 1, i - 1)
+        try:
+            Config(json.dumps(config), max_result_size=1000)
+            self.fail("EvaluationLimitError not raised")
+        except EvaluationLimitError:
+            """Expected error"""
+        small = {"k0": "ab", "k1": "${k0}${k0}", "k2": "${k1}${k1}"}
+        config = Config(json.dumps(small), max_result_size=1000)
+        self.assertEquals("abababab", config['k2'])
+
+    def test_timeout_restores_alarm(self):
+        """
+        Test the caller's SIGALRM handler and timer are restored.
+        """
+        def handler(signum, frame):
+            pass
+        previous = signal.signal(signal.SIGALRM, handler)
+        signal.setitimer(signal.ITIMER_REAL, 100, 50)
+        try:
+            config = Config('{ "a": "{{ 1 + 1 }}" }', expression_timeout=10)
+            self.assertEquals(2, config['a'])
+            self.assertTrue(signal.getsignal(signal.SIGALRM) is handler)
+            delay, interval = signal.getitimer(signal.ITIMER_REAL)
+            self.assertTrue(90 < delay <= 100)
+            self.assertEquals(50, interval)
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous)
+
+    def test_max_depth(self):
+        """
+        Test chains of variable references longer than max_depth.
+        """
+        # the result must not depend on the order keys are evaluated in
+        for names in itertools.permutations("abcd"):
+            config = {names[3]: "deep"}
+            for i in range(3):
+                config[names[i]] = "${%s}" % names[i + 1]
+            config_json = json.dumps(config)
+            try:
+                Config(config_json, max_depth=2)
+                self.fail("EvaluationLimitError not raised")
+            except EvaluationLimitError, e:
+                self.assertTrue(str(e).startswith("%s:" % names[0]))
+            config = Config(config_json, max_depth=3)
+            self.assertEquals("deep", config[names[0]])
+
+    def test_max_depth_object(self):
+        """
+        Test a reference to an object counts the references inside it.
+        """
+        config_json = """
+        {
+            "a": "{{ ${obj} }}",
+            "obj": { "b": "${c}" },
+            "c": 1
+        }
+        """
+        self.assertRaises(EvaluationLimitError, Config, config_json,
+                          max_depth=1)
+        config = Config(config_json, max_depth=2)
+        self.assertEquals({"b": "1"}, config['a'])
+
+    def test_view(self):
+        """
+        Test the read-only view of the evaluated config.
+        """
+        config_json = """
+        {
+            "person": {
+                "name": "John",
+                "address": { "town": "Dublin" }
+            },
+            "j": "${person.name}",
+            "keys": "{{ 2 }}",
+            "class": "MyClassName",
+            "db-name": "testdb",
+            "__len__": 1,
+            "e": [ "a", { "f": "b" } ],
+            "g": [1, 2, 3]
+        }
+        """
+        config = Config(config_json, array_threshold=3)
+        view = config.view()
+        self.assertEquals("John", view.j)
+        self.assertEquals("Dublin", view.person.address.town)
+        self.assertEquals(2, view.keys)
+        self.assertEquals("MyClassName", getattr(view, 'class'))
+        self.assertEquals("testdb", view['db-name'])
+        self.assertEquals(1, view['__len__'])
+        self.assertEquals("John", view['person']['name'])
+        self.assertEquals("b", view.e[1].f)
+        self.assertEquals((1, 2, 3), view.g)
+        self.assertTrue(isinstance(view.g, tuple))
+        self.assertRaises(TypeError, operator.setitem, view.g, 0, 999)
+        self.assertEquals(1, config['g'][0])
+        self.assertEquals(8, len(view))
+        self.assertTrue("db-name" in view)
+        self.assertEquals(sorted(config.keys()), list(view))
+        self.assertRaises(KeyError, lambda: view['missing'])
+        self.assertRaises(AttributeError, lambda: view.missing)
+        self.assertRaises(AttributeError, setattr, view, 'j', 'Jack')
+        self.assertTrue(isinstance(view.e, tuple))
+
+    def test_view_reserved_keys(self):
+        """
+        Test keys named like the view internals are still exposed.
+        """
+        config_json = """
+        {
+            "_keys": 1,
+            "_slots": 2,
+            "_ConfigView__extra": 3,
+            "__keys__": 4,
+            "__slotkeys__": 5,
+            "__extra__": 6,
+            "a-b": 7
+        }
+        """
+        view = Config(config_json).view()
+        self.assertEquals(1, view._keys)
+        self.assertEquals(2, view._slots)
+        self.assertEquals(3, view._ConfigView__extra)
+        self.assertEquals(4, view['__keys__'])
+        self.assertEquals(5, view['__slotkeys__'])
+        self.assertEquals(6, view['__extra__'])
+        self.assertEquals(7, view['a-b'])
+        self.assertEquals(7, len(view))
+
+    def test_view_class_released(self):
+        """
+        Test generated view classes are released with their views.
+        """
+        view = Config('{ "u123456": { "v654321": 1 } }').view()
+        classes = [weakref.ref(type(view)), weakref.ref(type(view.u123456))]
+        del view
+        gc.collect()
+        self.assertEquals([None, None], [cls() for cls in classes])
+
+    def test_view_shape(self):
+        """
+        Test objects with the same keys share a view class.
+        """
+        config_json = """
+        {
+            "a": { "x": 1, "y": 2 },
+            "b": { "y": 3, "x": 4 },
+            "c": { "x": 5 }
+        }
+        """
+        view = Config(config_json).view()
+        self.assertTrue(type(view.a) is type(view.b))
+        self.assertFalse(type(view.a) is type(view.c))
+        self.assertEquals(4, view.b.x)
+
 if __name__ == "__main__":
     unittest.main()